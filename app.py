@@ -6,20 +6,45 @@ Then open: http://localhost:8080
 """
 
 import os
+import re
+import sys
 import json
-import uuid
+import queue
 import random
+import socket
+import hashlib
+import asyncio
+import sqlite3
+import tempfile
 import mimetypes
 import threading
 from pathlib import Path
 from datetime import datetime
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 from urllib.parse import urlparse, parse_qs, unquote
 
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if orjson is not None:
+    def json_dumps(data) -> bytes:
+        return orjson.dumps(data)
+else:
+    def json_dumps(data) -> bytes:
+        return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode()
+
 # ── Config ────────────────────────────────────────────────────────────────────
 PORT = 8080
 UPLOAD_DIR = Path("uploads")
-DB_FILE    = Path("songs.json")
+DB_FILE    = Path("songs.db")
+LEGACY_DB  = Path("songs.json")   # imported into songs.db on first run
 CHUNK_SIZE = 65536   # 64 KB streaming chunks
 
 ALLOWED_EXTS = {
@@ -29,74 +54,889 @@ ALLOWED_EXTS = {
 
 UPLOAD_DIR.mkdir(exist_ok=True)
 
-# ── Simple JSON "database" ─────────────────────────────────────────────────────
+# ── SQLite "database" ─────────────────────────────────────────────────────────
+# WAL mode: adds/deletes are O(log N) keyed writes instead of rewriting the
+# whole library file, and the hot lookup paths never pay a JSON reparse.
 db_lock = threading.Lock()
 
-def load_db() -> list:
-    if DB_FILE.exists():
+_SONG_COLUMNS = ("id", "title", "artist", "comment", "filename",
+                 "ext", "size", "uploaded", "wav_header")
+
+_db = sqlite3.connect(str(DB_FILE), check_same_thread=False)
+_db.row_factory = sqlite3.Row
+_db.execute("PRAGMA journal_mode=WAL")
+_db.execute("PRAGMA synchronous=NORMAL")
+_db.execute("""
+    CREATE TABLE IF NOT EXISTS songs (
+        id         TEXT PRIMARY KEY,
+        title      TEXT NOT NULL,
+        artist     TEXT NOT NULL,
+        comment    TEXT NOT NULL DEFAULT '',
+        filename   TEXT NOT NULL,
+        ext        TEXT NOT NULL,
+        size       INTEGER NOT NULL,
+        uploaded   TEXT NOT NULL,
+        wav_header TEXT,
+        title_lc   TEXT NOT NULL DEFAULT '',
+        artist_lc  TEXT NOT NULL DEFAULT ''
+    )""")
+# Search columns are folded once at insert time; add + backfill them when
+# upgrading a pre-existing table.
+if "title_lc" not in {r[1] for r in _db.execute("PRAGMA table_info(songs)")}:
+    _db.execute("ALTER TABLE songs ADD COLUMN title_lc TEXT NOT NULL DEFAULT ''")
+    _db.execute("ALTER TABLE songs ADD COLUMN artist_lc TEXT NOT NULL DEFAULT ''")
+    _db.execute("UPDATE songs SET title_lc = lower(title), artist_lc = lower(artist)")
+_db.commit()
+
+def _row_to_song(row) -> dict:
+    song = {k: row[k] for k in _SONG_COLUMNS}
+    if song["wav_header"] is None:
+        del song["wav_header"]
+    return song
+
+def _public_song(song: dict) -> dict:
+    """API view of a song: the wav_header cache is streaming-internal state."""
+    song.pop("wav_header", None)
+    return song
+
+def _import_legacy_json():
+    """One-time import of the old songs.json library."""
+    if not LEGACY_DB.exists():
+        return
+    with db_lock, _db:
+        if _db.execute("SELECT 1 FROM songs LIMIT 1").fetchone():
+            return
         try:
-            return json.loads(DB_FILE.read_text(encoding="utf-8"))
+            songs = json.loads(LEGACY_DB.read_text(encoding="utf-8"))
         except Exception:
-            pass
-    return []
+            return
+        _db.executemany(
+            "INSERT OR IGNORE INTO songs VALUES (?,?,?,?,?,?,?,?,?,?,?)",
+            [tuple(s.get(k) for k in _SONG_COLUMNS)
+             + (s.get("title", "").lower(), s.get("artist", "").lower())
+             for s in songs])
 
-def save_db(songs: list):
-    DB_FILE.write_text(json.dumps(songs, ensure_ascii=False, indent=2), encoding="utf-8")
+_import_legacy_json()
 
-def get_songs():
+def get_songs() -> list:
     with db_lock:
-        return load_db()
+        rows = _db.execute("SELECT * FROM songs ORDER BY rowid").fetchall()
+    return [_public_song(_row_to_song(r)) for r in rows]
 
-def add_song(meta: dict):
+def search_songs(q: str) -> list:
+    if not q:
+        return get_songs()
+    like = "%" + q.replace("\\", "\\\\").replace("%", r"\%").replace("_", r"\_") + "%"
     with db_lock:
-        songs = load_db()
-        songs.append(meta)
-        save_db(songs)
+        rows = _db.execute(
+            r"SELECT * FROM songs WHERE title_lc LIKE ? ESCAPE '\' "
+            r"OR artist_lc LIKE ? ESCAPE '\' ORDER BY rowid",
+            (like, like)).fetchall()
+    return [_public_song(_row_to_song(r)) for r in rows]
+
+def get_song(song_id: str):
+    """Keyed fetch on the primary key."""
+    with db_lock:
+        row = _db.execute("SELECT * FROM songs WHERE id = ?", (song_id,)).fetchone()
+    return _row_to_song(row) if row else None
+
+# All writes go through this process, so a small id list can be kept hot for
+# /api/random, and a version counter (seeded per boot) backs the library
+# ETag. Both live under db_lock.
+_id_cache   = None
+_db_version = int.from_bytes(os.urandom(4), "little")
+
+def _song_ids() -> list:
+    global _id_cache
+    if _id_cache is None:
+        _id_cache = [r[0] for r in
+                     _db.execute("SELECT id FROM songs ORDER BY rowid")]
+    return _id_cache
+
+def library_etag() -> str:
+    return f'W/"lib-{_db_version}"'
+
+def pick_random_song(exclude_id: str = ""):
+    """One draw on the id list plus one identity check — no pool copy, no
+    full-table fetch."""
+    with db_lock:
+        ids = _song_ids()
+        if not ids:
+            return None
+        idx = random.randrange(len(ids))
+        sid = ids[idx]
+        if sid == exclude_id and len(ids) > 1:
+            sid = ids[(idx + 1) % len(ids)]
+    song = get_song(sid)
+    return _public_song(song) if song else None
+
+def add_song(meta: dict):
+    global _db_version
+    with db_lock, _db:
+        _db.execute("INSERT INTO songs VALUES (?,?,?,?,?,?,?,?,?,?,?)",
+                    tuple(meta.get(k) for k in _SONG_COLUMNS)
+                    + (meta["title"].lower(), meta["artist"].lower()))
+        if _id_cache is not None:
+            _id_cache.append(meta["id"])
+        _db_version += 1
 
 def delete_song_by_id(song_id: str) -> bool:
-    with db_lock:
-        songs = load_db()
-        new = [s for s in songs if s["id"] != song_id]
-        if len(new) == len(songs):
-            return False
-        save_db(new)
-    return True
+    global _id_cache, _db_version
+    with db_lock, _db:
+        cur = _db.execute("DELETE FROM songs WHERE id = ?", (song_id,))
+        if cur.rowcount > 0:
+            _id_cache = None
+            _db_version += 1
+    return cur.rowcount > 0
+
+# ── multipart parser ──────────────────────────────────────────────────────────
+# Streaming parser: the body is consumed incrementally through a pooled scratch
+# bytearray, boundaries are located with bytes.find on a sliding window, and
+# the file part is written straight to disk — the upload is never held whole
+# in memory (and never .split() into per-part copies).
+
+_MPARSER_BUF_SIZE = 1 << 20
+_MPARSER_BUFS = queue.LifoQueue(maxsize=8)   # LIFO → reuse the cache-warm buffer
+
+def _acquire_buf() -> bytearray:
+    try:
+        return _MPARSER_BUFS.get_nowait()
+    except queue.Empty:
+        return bytearray(_MPARSER_BUF_SIZE)
+
+def _release_buf(buf: bytearray):
+    try:
+        _MPARSER_BUFS.put_nowait(buf)
+    except queue.Full:
+        pass
+
+# Part headers are small ASCII: one C-level regex scan each beats walking the
+# lines with lower()/startswith/split chains. The lookbehind keeps name= from
+# matching inside filename=; values may be quoted or bare.
+_CD_LINE_RE = re.compile(rb"^content-disposition:(.*)$", re.I | re.M)
+_CD_NAME_RE = re.compile(rb'(?<![\w-])name=(?:"([^"]*)"|([^";\r\n]+))')
+_CD_FILE_RE = re.compile(rb'filename=(?:"([^"]*)"|([^";\r\n]+))')
+
+def _cd_param(regex, disp: bytes):
+    m = regex.search(disp)
+    if not m:
+        return None
+    value = m.group(1) if m.group(1) is not None else m.group(2)
+    return value.decode(errors="replace")
+
+def _parse_part_headers(raw: bytes):
+    """Pull (name, filename) out of a part's header block."""
+    m = _CD_LINE_RE.search(raw)
+    if not m:
+        return "", None
+    disp = m.group(1)
+    return _cd_param(_CD_NAME_RE, disp) or "", _cd_param(_CD_FILE_RE, disp)
+
+class MultipartParser:
+    """Push-style multipart/form-data parser.
+
+    Callers feed() raw socket bytes as they arrive; form fields collect in
+    .fields and the first file part is written straight to the file object
+    returned by spool_factory(), keeping only a boundary-sized tail
+    buffered. Works the same whether it is driven from a blocking rfile or
+    an asyncio StreamReader.
+    """
+
+    def __init__(self, boundary: bytes, spool_factory):
+        self._delim = b"--" + boundary
+        self._sep   = b"\r\n" + self._delim
+        self._keep  = len(self._sep) + 3   # partial boundary + trailing "--\r\n"
+        self._spool_factory = spool_factory
+
+        self.fields    = {}
+        self.spool     = None
+        self.filename  = None
+        self.file_size = 0
+        self.done      = False
+
+        self._buf      = bytearray()
+        self._state    = "preamble"
+        self._name     = ""
+        self._fn       = None
+        self._to_spool = False
+        self._scan     = 0     # find() resume offset: never rescan seen bytes
+
+    def feed(self, data):
+        if self.done:
+            return
+        self._buf.extend(data)
+        self._process()
+
+    def _process(self):
+        buf = self._buf
+        while not self.done:
+            if self._state == "preamble":
+                # Skip up to the first delimiter
+                i = buf.find(self._delim)
+                if i < 0:
+                    del buf[:max(0, len(buf) - len(self._delim) + 1)]
+                    return
+                del buf[:i + len(self._delim)]
+                self._state = "delim"
+                self._scan  = 0
+
+            elif self._state == "delim":
+                # After a delimiter: "--" closes the stream, CRLF opens a part
+                if len(buf) < 2:
+                    return
+                if buf[:2] == b"--":
+                    self.done = True
+                    return
+                if buf[:2] == b"\r\n":
+                    del buf[:2]
+                self._state = "headers"
+
+            elif self._state == "headers":
+                i = buf.find(b"\r\n\r\n", self._scan)
+                if i < 0:
+                    self._scan = max(0, len(buf) - 3)
+                    return
+                self._name, self._fn = _parse_part_headers(bytes(memoryview(buf)[:i]))
+                del buf[:i + 4]
+                self._to_spool = self._fn is not None and self.spool is None
+                if self._to_spool:
+                    self.spool    = self._spool_factory()
+                    self.filename = self._fn
+                self._state = "body"
+                self._scan  = 0
+
+            else:   # body
+                i = buf.find(self._sep, self._scan)
+                if i < 0:
+                    self._scan = max(0, len(buf) - len(self._sep) + 1)
+                    if self._to_spool:
+                        flush = len(buf) - self._keep
+                        if flush > 0:
+                            self.spool.write(memoryview(buf)[:flush])
+                            self.file_size += flush
+                            del buf[:flush]
+                            self._scan = max(0, self._scan - flush)
+                    return
+                if self._to_spool:
+                    self.spool.write(memoryview(buf)[:i])
+                    self.file_size += i
+                elif self._fn is None and self._name:
+                    self.fields[self._name] = bytes(memoryview(buf)[:i]).decode(errors="replace")
+                del buf[:i + len(self._sep)]
+                self._state = "delim"
+                self._scan  = 0
+
+def parse_boundary(content_type: str):
+    """Extract the multipart boundary from a Content-Type header, or None."""
+    for part in content_type.split(";"):
+        part = part.strip()
+        if part.startswith("boundary="):
+            return part[9:].strip('"').encode()
+    return None
+
+def _new_upload_parser(boundary: bytes):
+    """A MultipartParser spooling its file part to a temp file in UPLOAD_DIR."""
+    spooled = {}
+
+    def spool_factory():
+        f = tempfile.NamedTemporaryFile(dir=UPLOAD_DIR, suffix=".part", delete=False)
+        spooled["path"] = Path(f.name)
+        return f
+
+    return MultipartParser(boundary, spool_factory), spooled
+
+def _finish_upload(parser: MultipartParser, spooled: dict):
+    if parser.spool is not None:
+        parser.spool.close()
+    return store_upload(parser.fields, spooled.get("path"),
+                        parser.filename, parser.file_size)
+
+def _abort_upload(parser: MultipartParser, spooled: dict):
+    """Discard a half-received upload: close and unlink the spooled temp file."""
+    if parser.spool is not None:
+        try:
+            parser.spool.close()
+        except OSError:
+            pass
+    path = spooled.get("path")
+    if path is not None:
+        path.unlink(missing_ok=True)
+
+def receive_upload(rfile, length: int, boundary: bytes):
+    """Parse a multipart body from a blocking rfile and persist its file part.
+
+    The file part is spooled to a temp file inside UPLOAD_DIR as it arrives,
+    then renamed into place once validated. Returns (meta, error_message)."""
+    parser, spooled = _new_upload_parser(boundary)
+    scratch = _acquire_buf()
+    remaining = length
+    try:
+        while remaining > 0:
+            n = rfile.readinto(memoryview(scratch)[:min(len(scratch), remaining)])
+            if not n:
+                break
+            remaining -= n
+            # Keep draining past the closing boundary so a kept-alive
+            # connection is left positioned at the next request
+            parser.feed(memoryview(scratch)[:n])
+    except Exception:
+        _abort_upload(parser, spooled)
+        raise
+    finally:
+        _release_buf(scratch)
+    if remaining > 0:
+        # Client went away mid-body; don't let the truncated spool survive.
+        _abort_upload(parser, spooled)
+        return None, "Incomplete upload"
+    return _finish_upload(parser, spooled)
+
+async def receive_upload_async(reader, length: int, boundary: bytes):
+    """Async twin of receive_upload, fed from an asyncio StreamReader."""
+    parser, spooled = _new_upload_parser(boundary)
+    remaining = length
+    try:
+        while remaining > 0:
+            chunk = await reader.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            parser.feed(chunk)
+    except Exception:
+        _abort_upload(parser, spooled)
+        raise
+    if remaining > 0:
+        _abort_upload(parser, spooled)
+        return None, "Incomplete upload"
+    return _finish_upload(parser, spooled)
+
+def store_upload(fields: dict, tmp_path, filename, size: int):
+    """Validate a spooled upload and move it into the library; returns (meta, error_message)."""
+    title  = fields.get("title", "").strip() or "Unknown Title"
+    artist = fields.get("artist", "").strip() or "Unknown Artist"
+    comment= fields.get("comment", "").strip()
+
+    if tmp_path is None or not filename or not size:
+        if tmp_path is not None:
+            tmp_path.unlink(missing_ok=True)
+        return None, "No file uploaded"
+
+    ext = Path(filename).suffix.lower()
+    if ext not in ALLOWED_EXTS:
+        tmp_path.unlink(missing_ok=True)
+        return None, f"Unsupported format: {ext}"
+
+    wav_header = None
+    if ext == ".fc":
+        # Validate the 6-byte preamble before the file enters the library,
+        # and precompute the WAV header once so streaming never re-reads the
+        # preamble or re-packs the struct.
+        if size < 6:
+            tmp_path.unlink(missing_ok=True)
+            return None, "Truncated .fc file"
+        with open(tmp_path, "rb") as f:
+            hdr = f.read(6)
+        sample_rate = int.from_bytes(hdr[0:4], "little")
+        channels    = int.from_bytes(hdr[4:6], "little")
+        if not (0 < sample_rate <= 384000 and 0 < channels <= 8):
+            tmp_path.unlink(missing_ok=True)
+            return None, "Invalid .fc header"
+        wav_header = build_wav_header(sample_rate, channels, size - 6).hex()
+
+    # 128 random bits straight to hex — the id is only a filename/key, so
+    # skip the UUID object construction and hyphen formatting
+    song_id   = os.urandom(16).hex()
+    save_name = f"{song_id}{ext}"
+    dest      = UPLOAD_DIR / save_name
+    tmp_path.rename(dest)
+
+    meta = {
+        "id":       song_id,
+        "title":    title,
+        "artist":   artist,
+        "comment":  comment,
+        "filename": save_name,
+        "ext":      ext,
+        "size":     size,
+        "uploaded": datetime.utcnow().isoformat() + "Z",
+    }
+    if wav_header is not None:
+        meta["wav_header"] = wav_header
+    add_song(meta)
+    return _public_song(meta), None
+
+def parse_range_header(range_header, file_size: int):
+    """Resolve a `Range: bytes=a-b` header against file_size → (start, end).
+
+    Walks the digits directly instead of split()+int(): zero intermediate
+    allocations on a path hit once per browser seek."""
+    start, end = 0, file_size - 1
+    if not range_header or not range_header.startswith("bytes="):
+        return start, end
+
+    i, n = 6, len(range_header)
+    a = -1
+    while i < n and "0" <= range_header[i] <= "9":
+        a = (a if a >= 0 else 0) * 10 + (ord(range_header[i]) - 48)
+        i += 1
+    if i >= n or range_header[i] != "-":
+        return start, end
+    i += 1
+    b = -1
+    while i < n and "0" <= range_header[i] <= "9":
+        b = (b if b >= 0 else 0) * 10 + (ord(range_header[i]) - 48)
+        i += 1
+
+    if a >= 0:
+        start = a
+    if b >= 0:
+        end = b
+    # Validate in the same pass: RFC 7233 treats an over-large last-byte-pos
+    # as size - 1, and an inverted or out-of-file range would otherwise emit
+    # a Content-Length the body can't honour — normalize both to the full
+    # file so kept-alive connections never desync.
+    if end >= file_size:
+        end = file_size - 1
+    if start > end:
+        start, end = 0, file_size - 1
+    return start, end
+
+# Uploaded files are immutable (id-addressed filenames), so browsers and
+# proxies may cache streams forever; the song id doubles as a strong ETag.
+STREAM_CACHE = "public, max-age=31536000, immutable"
+
+def song_etag(target: dict) -> str:
+    return f'"{target["id"]}"'
+
+# index.html is the single most-hit path: keep the encoded bytes + ETag in
+# memory and only re-read when the file's mtime changes.
+_INDEX_FILE  = Path("index.html")
+_INDEX_CACHE = None   # (mtime_ns, data, etag)
+
+def load_index():
+    global _INDEX_CACHE
+    try:
+        st = _INDEX_FILE.stat()
+    except FileNotFoundError:
+        _INDEX_CACHE = None
+        return None
+    if _INDEX_CACHE is None or _INDEX_CACHE[0] != st.st_mtime_ns:
+        data = _INDEX_FILE.read_bytes()
+        etag = '"%s"' % hashlib.blake2b(data, digest_size=8).hexdigest()
+        _INDEX_CACHE = (st.st_mtime_ns, data, etag)
+    return _INDEX_CACHE
+
+load_index()   # warm at startup
+
+def fc_wav_plan(target: dict, fpath: Path, range_header):
+    """Plan serving an .fc file as a WAV stream, honouring Range.
+
+    The virtual stream is wav_header + PCM payload (file minus its 6-byte
+    preamble). Returns (status, headers, header_slice, file_offset,
+    file_count) so callers can write the header bytes and sendfile the rest.
+    """
+    wav_hex = target.get("wav_header")
+    if wav_hex:
+        wav_header = bytes.fromhex(wav_hex)
+    else:
+        # Songs uploaded before the header was cached in metadata
+        with open(fpath, "rb") as f:
+            hdr = f.read(6)
+        sample_rate = int.from_bytes(hdr[0:4], "little")
+        channels    = int.from_bytes(hdr[4:6], "little")
+        wav_header  = build_wav_header(sample_rate, channels,
+                                       fpath.stat().st_size - 6)
+
+    total      = len(wav_header) + fpath.stat().st_size - 6
+    start, end = parse_range_header(range_header, total)
+    length     = end - start + 1
+    status     = 206 if range_header else 200
+
+    header_slice = wav_header[start:start + length] if start < len(wav_header) else b""
+    file_offset  = 6 + max(0, start - len(wav_header))
+    file_count   = length - len(header_slice)
+
+    headers = [
+        ("Content-Type", "audio/wav"),
+        ("Content-Length", str(length)),
+        ("Content-Range", f"bytes {start}-{end}/{total}"),
+        ("Accept-Ranges", "bytes"),
+        ("Cache-Control", STREAM_CACHE),
+        ("ETag", song_etag(target)),
+    ]
+    return status, headers, header_slice, file_offset, file_count
+
+def build_wav_header(sample_rate: int, channels: int, pcm_size: int, bit_depth: int = 16) -> bytes:
+    import struct
+    byte_rate   = sample_rate * channels * bit_depth // 8
+    block_align = channels * bit_depth // 8
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF",
+        36 + pcm_size,
+        b"WAVE",
+        b"fmt ",
+        16,
+        1,
+        channels,
+        sample_rate,
+        byte_rate,
+        block_align,
+        bit_depth,
+        b"data",
+        pcm_size
+    )
+
+# ── Async server ──────────────────────────────────────────────────────────────
+# epoll-driven front end: hundreds of concurrent range-streams multiplex on one
+# thread, and file bodies go out through loop.sendfile() (kernel sendfile(2),
+# no 64 KB Python copy loop).  The blocking HTTPServer below is kept as a
+# fallback (`--sync`).
+
+HTTP_REASONS = {
+    200: "OK", 201: "Created", 204: "No Content", 206: "Partial Content",
+    304: "Not Modified", 400: "Bad Request", 404: "Not Found",
+    500: "Internal Server Error",
+}
+
+CORS_HEADERS = (
+    ("Access-Control-Allow-Origin", "*"),
+    ("Access-Control-Allow-Methods", "GET, POST, DELETE, OPTIONS"),
+    ("Access-Control-Allow-Headers", "Content-Type"),
+)
+
+def build_head(status: int, headers) -> bytes:
+    lines = [f"HTTP/1.1 {status} {HTTP_REASONS.get(status, 'OK')}"]
+    lines.extend(f"{k}: {v}" for k, v in headers)
+    lines.extend(f"{k}: {v}" for k, v in CORS_HEADERS)
+    lines.append("\r\n")
+    return "\r\n".join(lines).encode("latin-1")
+
+async def send_json_async(writer, data, status=200, headers=()):
+    body = json_dumps(data)
+    head = build_head(status, [
+        ("Content-Type", "application/json; charset=utf-8"),
+        ("Content-Length", str(len(body))),
+        *headers,
+    ])
+    writer.write(head + body)
+    await writer.drain()
+
+async def send_error_async(writer, msg, status=400):
+    await send_json_async(writer, {"error": msg}, status)
+
+async def handle_index(writer, headers):
+    cached = load_index()
+    if cached is None:
+        await send_error_async(writer, "index.html not found - put it next to this script", 404)
+        return
+    _, data, etag = cached
+    if headers.get("if-none-match") == etag:
+        writer.write(build_head(304, [("ETag", etag)]))
+        await writer.drain()
+        return
+    head = build_head(200, [
+        ("Content-Type", "text/html"),
+        ("Content-Length", str(len(data))),
+        ("Cache-Control", "no-cache"),
+        ("ETag", etag),
+    ])
+    writer.write(head + data)
+    await writer.drain()
+
+async def handle_songs(writer, qs, headers):
+    q = (qs.get("q", [""])[0]).lower()
+    if q:
+        await send_json_async(writer, search_songs(q))
+        return
+    etag = library_etag()
+    if headers.get("if-none-match") == etag:
+        writer.write(build_head(304, [("ETag", etag)]))
+        await writer.drain()
+        return
+    await send_json_async(writer, get_songs(), headers=[("ETag", etag)])
+
+async def handle_random(writer, qs):
+    exclude = qs.get("exclude", [""])[0]
+    song    = pick_random_song(exclude)
+    if song is None:
+        await send_error_async(writer, "No songs available", 404)
+        return
+    await send_json_async(writer, song, headers=[("Cache-Control", "no-store")])
+
+_HAS_CORK = hasattr(socket, "TCP_CORK")
+
+def set_cork(sock, flag: bool):
+    """Coalesce headers + first payload bytes into full segments (Linux)."""
+    if not _HAS_CORK or sock is None:
+        return
+    try:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, 1 if flag else 0)
+    except OSError:
+        pass
+
+def _advise_sequential(fd: int, start: int, length: int):
+    """Prime kernel readahead for the range about to be sendfile'd."""
+    if hasattr(os, "posix_fadvise"):
+        try:
+            os.posix_fadvise(fd, start, length, os.POSIX_FADV_SEQUENTIAL)
+            os.posix_fadvise(fd, start, length, os.POSIX_FADV_WILLNEED)
+        except OSError:
+            pass
+
+async def _sendfile_range(writer, fpath: Path, start: int, length: int):
+    loop = asyncio.get_running_loop()
+    with open(fpath, "rb") as f:
+        _advise_sequential(f.fileno(), start, length)
+        try:
+            # Kernel sendfile(2): zero-copy, no user-space chunk loop.
+            await loop.sendfile(writer.transport, f, offset=start, count=length)
+        except (NotImplementedError, AttributeError):
+            f.seek(start)
+            remaining = length
+            while remaining > 0:
+                chunk = f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                writer.write(chunk)
+                await writer.drain()
+                remaining -= len(chunk)
+
+async def handle_stream_fc(writer, fpath: Path, target: dict, headers: dict):
+    status, out_headers, header_slice, file_offset, file_count = \
+        fc_wav_plan(target, fpath, headers.get("range"))
+    sock = writer.get_extra_info("socket")
+    set_cork(sock, True)
+    try:
+        writer.write(build_head(status, out_headers) + header_slice)
+        await writer.drain()
+        if file_count > 0:
+            await _sendfile_range(writer, fpath, file_offset, file_count)
+    finally:
+        set_cork(sock, False)
+
+async def handle_stream(reader, writer, song_id, headers):
+    """Range-aware streaming (async twin of ChipHandler._stream)."""
+    target = get_song(unquote(song_id))
+    if not target:
+        await send_error_async(writer, "Not found", 404)
+        return
+
+    etag = song_etag(target)
+    if headers.get("if-none-match") == etag:
+        writer.write(build_head(304, [("ETag", etag),
+                                      ("Cache-Control", STREAM_CACHE)]))
+        await writer.drain()
+        return
+
+    fpath = UPLOAD_DIR / target["filename"]
+    if not fpath.exists():
+        await send_error_async(writer, "File missing", 404)
+        return
+    if target["ext"] == ".fc":
+        await handle_stream_fc(writer, fpath, target, headers)
+        return
+
+    file_size = fpath.stat().st_size
+    mime_type = mimetypes.guess_type(str(fpath))[0] or "application/octet-stream"
+
+    range_header = headers.get("range")
+    start, end = parse_range_header(range_header, file_size)
+    length = end - start + 1
+    status = 206 if range_header else 200
+
+    head = build_head(status, [
+        ("Content-Type", mime_type),
+        ("Content-Length", str(length)),
+        ("Content-Range", f"bytes {start}-{end}/{file_size}"),
+        ("Accept-Ranges", "bytes"),
+        ("Cache-Control", STREAM_CACHE),
+        ("ETag", etag),
+    ])
+    sock = writer.get_extra_info("socket")
+    set_cork(sock, True)
+    try:
+        writer.write(head)
+        await writer.drain()
+        await _sendfile_range(writer, fpath, start, length)
+    finally:
+        set_cork(sock, False)
+
+async def drain_body_async(reader, headers):
+    """Consume an unread request body so keep-alive stays in sync.
+
+    A rejected request must not leave its body bytes in the stream, where
+    they would be parsed as the next request head."""
+    remaining = int(headers.get("content-length", 0) or 0)
+    while remaining > 0:
+        chunk = await reader.read(min(CHUNK_SIZE, remaining))
+        if not chunk:
+            break
+        remaining -= len(chunk)
+
+async def handle_upload(reader, writer, headers):
+    ct = headers.get("content-type", "")
+    if "multipart/form-data" not in ct:
+        await drain_body_async(reader, headers)
+        await send_error_async(writer, "Expected multipart/form-data")
+        return
+    boundary = parse_boundary(ct)
+    if not boundary:
+        await drain_body_async(reader, headers)
+        await send_error_async(writer, "Missing boundary")
+        return
+
+    length = int(headers.get("content-length", 0))
+    meta, err = await receive_upload_async(reader, length, boundary)
+    if err:
+        await send_error_async(writer, err)
+        return
+    await send_json_async(writer, {"ok": True, "song": meta}, 201)
+
+async def handle_delete(writer, song_id):
+    target = get_song(song_id)
+    if not target:
+        await send_error_async(writer, "Not found", 404)
+        return
+    delete_song_by_id(song_id)
+    try:
+        (UPLOAD_DIR / target["filename"]).unlink(missing_ok=True)
+    except Exception:
+        pass
+    await send_json_async(writer, {"ok": True})
+
+async def handle_client(reader, writer):
+    try:
+        while True:
+            try:
+                head_raw = await reader.readuntil(b"\r\n\r\n")
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                break
+
+            request_line, *header_lines = head_raw.decode("latin-1").split("\r\n")
+            try:
+                method, raw_path, _ = request_line.split(" ", 2)
+            except ValueError:
+                break
+            headers = {}
+            for line in header_lines:
+                if ":" in line:
+                    k, _, v = line.partition(":")
+                    headers[k.strip().lower()] = v.strip()
+
+            parsed = urlparse(raw_path)
+            path   = parsed.path.rstrip("/") or "/"
+            qs     = parse_qs(parsed.query)
+            print(f"[{datetime.now().strftime('%H:%M:%S')}] {method} {raw_path}")
+
+            if method == "OPTIONS":
+                writer.write(build_head(204, []))
+                await writer.drain()
+            elif method == "GET" and path in ("/", "/index.html"):
+                await handle_index(writer, headers)
+            elif method == "GET" and path == "/api/songs":
+                await handle_songs(writer, qs, headers)
+            elif method == "GET" and path == "/api/random":
+                await handle_random(writer, qs)
+            elif method == "GET" and path.startswith("/stream/"):
+                await handle_stream(reader, writer, path[8:], headers)
+            elif method == "POST" and path == "/api/upload":
+                await handle_upload(reader, writer, headers)
+            elif method == "DELETE" and path.startswith("/api/songs/"):
+                await handle_delete(writer, path.split("/")[-1])
+            else:
+                await drain_body_async(reader, headers)
+                await send_error_async(writer, "Not found", 404)
+
+            if headers.get("connection", "").lower() == "close":
+                break
+    except (ConnectionError, BrokenPipeError):
+        pass
+    finally:
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except (ConnectionError, BrokenPipeError):
+            pass
+
+async def run_async_server():
+    server = await asyncio.start_server(handle_client, "0.0.0.0", PORT)
+    async with server:
+        await server.serve_forever()
 
 # ── HTTP Handler ──────────────────────────────────────────────────────────────
 class ChipHandler(BaseHTTPRequestHandler):
 
+    # Persistent connections: browsers seeking through a track reuse one TCP
+    # connection for their Range requests instead of handshaking per seek.
+    # Every response path sends Content-Length, so keep-alive is safe.
+    protocol_version = "HTTP/1.1"
+
+    # Nagle off; batching is handled explicitly with TCP_CORK where it helps
+    disable_nagle_algorithm = True
+
     def log_message(self, fmt, *args):
         print(f"[{datetime.now().strftime('%H:%M:%S')}] {fmt % args}")
 
     # ── helpers ──────────────────────────────────────────────────────────────
 
-    def send_json(self, data, status=200):
-        body = json.dumps(data, ensure_ascii=False).encode()
-        self.send_response(status)
-        self.send_header("Content-Type", "application/json; charset=utf-8")
-        self.send_header("Content-Length", str(len(body)))
-        self._cors()
-        self.end_headers()
-        self.wfile.write(body)
+    def _write_head(self, status, headers, body=b""):
+        """Emit the whole response head (plus an optional small body) as one
+        preformatted write — one send syscall instead of one per header."""
+        self.log_request(status)
+        self.wfile.write(build_head(status, headers) + body)
+
+    def send_json(self, data, status=200, headers=()):
+        body = json_dumps(data)
+        self._write_head(status, [
+            ("Content-Type", "application/json; charset=utf-8"),
+            ("Content-Length", str(len(body))),
+            *headers,
+        ], body)
 
     def send_error_json(self, msg, status=400):
         self.send_json({"error": msg}, status)
 
-    def _cors(self):
-        self.send_header("Access-Control-Allow-Origin", "*")
-        self.send_header("Access-Control-Allow-Methods", "GET, POST, DELETE, OPTIONS")
-        self.send_header("Access-Control-Allow-Headers", "Content-Type")
+    def _drain_body(self):
+        """Consume an unread request body so keep-alive stays in sync.
+
+        A rejected request must not leave its body bytes in rfile, where
+        they would be parsed as the next request line."""
+        remaining = int(self.headers.get("Content-Length", 0) or 0)
+        if not remaining:
+            return
+        scratch = _acquire_buf()
+        try:
+            while remaining > 0:
+                n = self.rfile.readinto(
+                    memoryview(scratch)[:min(len(scratch), remaining)])
+                if not n:
+                    break
+                remaining -= n
+        finally:
+            _release_buf(scratch)
 
     def read_body(self):
         length = int(self.headers.get("Content-Length", 0))
-        return self.rfile.read(length) if length else b""
+        if not length:
+            return b""
+        scratch = _acquire_buf()
+        buf = scratch if len(scratch) >= length else bytearray(length)
+        try:
+            view = memoryview(buf)[:length]
+            got  = 0
+            while got < length:
+                n = self.rfile.readinto(view[got:])
+                if not n:
+                    break
+                got += n
+            return bytes(view[:got])
+        finally:
+            _release_buf(scratch)
 
     # ── routing ──────────────────────────────────────────────────────────────
 
     def do_OPTIONS(self):
-        self.send_response(204)
-        self._cors()
-        self.end_headers()
+        self._write_head(204, [])
 
     def do_GET(self):
         parsed = urlparse(self.path)
@@ -104,7 +944,7 @@ class ChipHandler(BaseHTTPRequestHandler):
         qs     = parse_qs(parsed.query)
 
         if path == "/" or path == "/index.html":
-            self._serve_file(Path("index.html"), "text/html")
+            self._serve_index()
         elif path == "/api/songs":
             self._api_songs(qs)
         elif path == "/api/random":
@@ -121,6 +961,7 @@ class ChipHandler(BaseHTTPRequestHandler):
         if path == "/api/upload":
             self._api_upload()
         else:
+            self._drain_body()
             self.send_error_json("Not found", 404)
 
     def do_DELETE(self):
@@ -131,83 +972,53 @@ class ChipHandler(BaseHTTPRequestHandler):
             song_id = path.split("/")[-1]
             self._api_delete(song_id)
         else:
+            self._drain_body()
             self.send_error_json("Not found", 404)
 
     # ── endpoints ────────────────────────────────────────────────────────────
 
     def _api_songs(self, qs):
-        songs = get_songs()
         # Optional search
         q = (qs.get("q", [""])[0]).lower()
         if q:
-            songs = [s for s in songs if q in s.get("title","").lower()
-                     or q in s.get("artist","").lower()]
-        self.send_json(songs)
+            self.send_json(search_songs(q))
+            return
+        etag = library_etag()
+        if self.headers.get("If-None-Match") == etag:
+            self._write_head(304, [("ETag", etag)])
+            return
+        self.send_json(get_songs(), headers=[("ETag", etag)])
 
     def _api_random(self, qs):
         exclude = qs.get("exclude", [""])[0]
-        songs   = get_songs()
-        pool    = [s for s in songs if s["id"] != exclude] or songs
-        if not pool:
+        song    = pick_random_song(exclude)
+        if song is None:
             self.send_error_json("No songs available", 404)
             return
-        self.send_json(random.choice(pool))
+        self.send_json(song, headers=[("Cache-Control", "no-store")])
 
     def _api_upload(self):
         ct = self.headers.get("Content-Type", "")
         if "multipart/form-data" not in ct:
+            self._drain_body()
             self.send_error_json("Expected multipart/form-data")
             return
 
-        # Parse boundary
-        boundary = None
-        for part in ct.split(";"):
-            part = part.strip()
-            if part.startswith("boundary="):
-                boundary = part[9:].strip('"').encode()
-                break
+        boundary = parse_boundary(ct)
         if not boundary:
+            self._drain_body()
             self.send_error_json("Missing boundary")
             return
 
         length = int(self.headers.get("Content-Length", 0))
-        body   = self.rfile.read(length)
-
-        fields, file_data, filename = self._parse_multipart(body, boundary)
-
-        title  = fields.get("title", "").strip() or "Unknown Title"
-        artist = fields.get("artist", "").strip() or "Unknown Artist"
-        comment= fields.get("comment", "").strip()
-
-        if not file_data or not filename:
-            self.send_error_json("No file uploaded")
-            return
-
-        ext = Path(filename).suffix.lower()
-        if ext not in ALLOWED_EXTS:
-            self.send_error_json(f"Unsupported format: {ext}")
+        meta, err = receive_upload(self.rfile, length, boundary)
+        if err:
+            self.send_error_json(err)
             return
-
-        song_id   = str(uuid.uuid4())
-        save_name = f"{song_id}{ext}"
-        (UPLOAD_DIR / save_name).write_bytes(file_data)
-
-        meta = {
-            "id":       song_id,
-            "title":    title,
-            "artist":   artist,
-            "comment":  comment,
-            "filename": save_name,
-            "ext":      ext,
-            "size":     len(file_data),
-            "uploaded": datetime.utcnow().isoformat() + "Z",
-        }
-        add_song(meta)
         self.send_json({"ok": True, "song": meta}, 201)
 
     def _api_delete(self, song_id):
-        songs = get_songs()
-        target = next((s for s in songs if s["id"] == song_id), None)
+        target = get_song(song_id)
         if not target:
             self.send_error_json("Not found", 404)
             return
@@ -217,162 +1028,118 @@ class ChipHandler(BaseHTTPRequestHandler):
         except Exception:
             pass
         self.send_json({"ok": True})
-    def _stream_fc_as_wav(self, fpath):
-        with open(fpath, "rb") as f:
-            header = f.read(6)
-
-            sample_rate = int.from_bytes(header[0:4], "little")
-            channels    = int.from_bytes(header[4:6], "little")
-            bit_depth   = 16
-
-            pcm_size = os.path.getsize(fpath) - 6
-
-            import struct
-
-            byte_rate = sample_rate * channels * bit_depth // 8
-            block_align = channels * bit_depth // 8
-
-            wav_header = struct.pack(
-            "<4sI4s4sIHHIIHH4sI",
-            b"RIFF",
-            36 + pcm_size,
-            b"WAVE",
-            b"fmt ",
-            16,
-            1,
-            channels,
-            sample_rate,
-            byte_rate,
-            block_align,
-            bit_depth,
-            b"data",
-            pcm_size
-            )
-
-            self.send_response(200)
-            self.send_header("Content-Type", "audio/wav")
-            self.end_headers()
-
-            self.wfile.write(wav_header)
-
-            while True:
-                chunk = f.read(CHUNK_SIZE)
-                if not chunk:
-                    break
-                self.wfile.write(chunk)
+    def _stream_fc_as_wav(self, fpath, target):
+        status, out_headers, header_slice, file_offset, file_count = \
+            fc_wav_plan(target, fpath, self.headers.get("Range"))
+
+        set_cork(self.connection, True)
+        try:
+            self._write_head(status, out_headers, header_slice)
+            if file_count > 0:
+                with open(fpath, "rb") as f:
+                    self._send_file_range(f, file_offset, file_count)
+        finally:
+            set_cork(self.connection, False)
     def _stream(self, raw_id):
         """Range-aware streaming"""
-        song_id = unquote(raw_id)
-        songs   = get_songs()
-        target  = next((s for s in songs if s["id"] == song_id), None)
+        target = get_song(unquote(raw_id))
         if not target:
             self.send_error_json("Not found", 404)
             return
 
+        etag = song_etag(target)
+        if self.headers.get("If-None-Match") == etag:
+            self._write_head(304, [("ETag", etag),
+                                   ("Cache-Control", STREAM_CACHE)])
+            return
+
         fpath = UPLOAD_DIR / target["filename"]
         if not fpath.exists():
             self.send_error_json("File missing", 404)
             return
         if target["ext"] == ".fc":
-            self._stream_fc_as_wav(fpath)
+            self._stream_fc_as_wav(fpath, target)
             return
         file_size = fpath.stat().st_size
         mime_type = mimetypes.guess_type(str(fpath))[0] or "application/octet-stream"
 
         # Range header support
         range_header = self.headers.get("Range")
-        start, end = 0, file_size - 1
-
-        if range_header and range_header.startswith("bytes="):
-            parts = range_header[6:].split("-")
-            try:
-                start = int(parts[0]) if parts[0] else 0
-                end   = int(parts[1]) if len(parts) > 1 and parts[1] else file_size - 1
-            except ValueError:
-                pass
+        start, end = parse_range_header(range_header, file_size)
 
         length = end - start + 1
         status = 206 if range_header else 200
 
-        self.send_response(status)
-        self.send_header("Content-Type", mime_type)
-        self.send_header("Content-Length", str(length))
-        self.send_header("Content-Range", f"bytes {start}-{end}/{file_size}")
-        self.send_header("Accept-Ranges", "bytes")
-        self.send_header("Cache-Control", "no-cache")
-        self._cors()
-        self.end_headers()
-
-        with open(fpath, "rb") as f:
-            f.seek(start)
-            remaining = length
-            while remaining > 0:
-                chunk = f.read(min(CHUNK_SIZE, remaining))
-                if not chunk:
-                    break
-                try:
-                    self.wfile.write(chunk)
-                except BrokenPipeError:
+        set_cork(self.connection, True)
+        try:
+            self._write_head(status, [
+                ("Content-Type", mime_type),
+                ("Content-Length", str(length)),
+                ("Content-Range", f"bytes {start}-{end}/{file_size}"),
+                ("Accept-Ranges", "bytes"),
+                ("Cache-Control", STREAM_CACHE),
+                ("ETag", etag),
+            ])
+            with open(fpath, "rb") as f:
+                self._send_file_range(f, start, length)
+        finally:
+            set_cork(self.connection, False)
+
+    def _send_file_range(self, f, start: int, length: int):
+        """Copy a file range to the socket via kernel sendfile(2).
+
+        Falls back to the chunked read/write loop when the connection is not
+        a plain socket fd (e.g. a TLS wrapper)."""
+        sent = 0
+        try:
+            self.wfile.flush()
+            out_fd = self.connection.fileno()
+            in_fd  = f.fileno()
+            _advise_sequential(in_fd, start, length)
+            while sent < length:
+                n = os.sendfile(out_fd, in_fd, start + sent, length - sent)
+                if not n:
                     break
-                remaining -= len(chunk)
+                sent += n
+            return
+        except (BrokenPipeError, ConnectionResetError):
+            return
+        except (AttributeError, OSError):
+            if sent:
+                # Part of the range already hit the socket; restarting the
+                # copy would duplicate bytes inside a fixed Content-Length
+                # response, so treat the connection as dead instead.
+                return
+            # no usable fds → plain Python copy below
+
+        f.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            try:
+                self.wfile.write(chunk)
+            except BrokenPipeError:
+                break
+            remaining -= len(chunk)
 
-    def _serve_file(self, fpath: Path, mime: str):
-        if not fpath.exists():
+    def _serve_index(self):
+        cached = load_index()
+        if cached is None:
             self.send_error_json("index.html not found - put it next to this script", 404)
             return
-        data = fpath.read_bytes()
-        self.send_response(200)
-        self.send_header("Content-Type", mime)
-        self.send_header("Content-Length", str(len(data)))
-        self.end_headers()
-        self.wfile.write(data)
-
-    # ── multipart parser ─────────────────────────────────────────────────────
-
-    def _parse_multipart(self, body: bytes, boundary: bytes):
-        fields = {}
-        file_data = None
-        filename  = None
-
-        delimiter = b"--" + boundary
-        parts = body.split(delimiter)
-
-        for part in parts[1:]:
-            if part in (b"", b"--", b"--\r\n"):
-                continue
-            if part.startswith(b"\r\n"):
-                part = part[2:]
-            if b"\r\n\r\n" not in part:
-                continue
-
-            headers_raw, _, content = part.partition(b"\r\n\r\n")
-            # Strip trailing --\r\n or \r\n
-            content = content.rstrip(b"\r\n").rstrip(b"--").rstrip(b"\r\n")
-
-            headers_text = headers_raw.decode(errors="replace")
-            disp = ""
-            for line in headers_text.splitlines():
-                if line.lower().startswith("content-disposition"):
-                    disp = line
-                    break
-
-            # Parse name
-            name = ""
-            fn   = None
-            for seg in disp.split(";"):
-                seg = seg.strip()
-                if seg.startswith("name="):
-                    name = seg[5:].strip('"')
-                elif seg.startswith("filename="):
-                    fn   = seg[9:].strip('"')
-
-            if fn:
-                file_data = content
-                filename  = fn
-            elif name:
-                fields[name] = content.decode(errors="replace")
-
-        return fields, file_data, filename
+        _, data, etag = cached
+        if self.headers.get("If-None-Match") == etag:
+            self._write_head(304, [("ETag", etag)])
+            return
+        # head + body leave in a single write, so no cork dance needed here
+        self._write_head(200, [
+            ("Content-Type", "text/html"),
+            ("Content-Length", str(len(data))),
+            ("Cache-Control", "no-cache"),
+            ("ETag", etag),
+        ], data)
 
 
 # ── Entry point ───────────────────────────────────────────────────────────────
@@ -385,5 +1152,12 @@ if __name__ == "__main__":
 Uploads : {UPLOAD_DIR.resolve()}
 DB      : {DB_FILE.resolve()}
 """)
-    server = HTTPServer(("0.0.0.0", PORT), ChipHandler)
-    server.serve_forever()
+    if "--sync" in sys.argv:
+        # Blocking fallback: one thread per connection
+        server = ThreadingHTTPServer(("0.0.0.0", PORT), ChipHandler)
+        server.daemon_threads = True
+        server.serve_forever()
+    else:
+        if uvloop is not None:
+            uvloop.install()
+        asyncio.run(run_async_server())